@@ -0,0 +1,34 @@
+"""add transactions (user_id, purchase_date desc, id) index
+
+Revision ID: 3b7d2e9a41c5
+Revises: c1ffe7a7e14f
+Create Date: 2025-06-02 11:18:04.520317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7d2e9a41c5'
+down_revision: Union[str, None] = 'c1ffe7a7e14f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Покрывающий индекс для keyset-пагинации истории транзакций пользователя
+    op.create_index(
+        'ix_transactions_user_id_purchase_date_id',
+        'transactions',
+        ['user_id', sa.text('purchase_date DESC'), 'id'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_transactions_user_id_purchase_date_id', table_name='transactions')
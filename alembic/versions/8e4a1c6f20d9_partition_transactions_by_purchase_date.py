@@ -0,0 +1,127 @@
+"""partition transactions by purchase_date, store raw_data as jsonb
+
+Revision ID: 8e4a1c6f20d9
+Revises: 3b7d2e9a41c5
+Create Date: 2025-06-09 17:02:41.873104
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4a1c6f20d9'
+down_revision: Union[str, None] = '3b7d2e9a41c5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Сколько месяцев вперёд создаём партиции при миграции (дальше — src.services.partition_service)
+MONTHS_AHEAD = 3
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Старую таблицу переименовываем, освобождая имена индексов/констрейнтов
+    op.rename_table('transactions', 'transactions_legacy')
+    op.drop_index('ix_transactions_user_id_purchase_date_id', table_name='transactions_legacy')
+    op.drop_index('ix_transactions_transaction_id', table_name='transactions_legacy')
+    op.execute('ALTER TABLE transactions_legacy RENAME CONSTRAINT transactions_pkey TO transactions_legacy_pkey')
+    # Последовательность id переиспользуем, чтобы идентификаторы шли без разрыва
+    op.execute('ALTER SEQUENCE transactions_id_seq OWNED BY NONE')
+
+    # Ключ партиционирования обязан входить в PK и уникальные индексы
+    op.create_table('transactions',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('transactions_id_seq'::regclass)"), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('product_id', sa.Integer(), nullable=True),
+    sa.Column('transaction_id', sa.String(), nullable=True),
+    sa.Column('original_transaction_id', sa.String(), nullable=True),
+    sa.Column('type', sa.String(), nullable=True),
+    sa.Column('quantity', sa.Integer(), nullable=True),
+    sa.Column('purchase_date', sa.DateTime(), nullable=False),
+    sa.Column('raw_data', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id', 'purchase_date'),
+    postgresql_partition_by='RANGE (purchase_date)',
+    )
+    op.create_index(op.f('ix_transactions_transaction_id'), 'transactions', ['transaction_id', 'purchase_date'], unique=True)
+    op.create_index(
+        'ix_transactions_user_id_purchase_date_id',
+        'transactions',
+        ['user_id', sa.text('purchase_date DESC'), 'id'],
+        unique=False,
+    )
+
+    # Помесячные партиции: от самой старой транзакции до MONTHS_AHEAD месяцев вперёд + default
+    op.execute(f"""
+    DO $$
+    DECLARE m date;
+    BEGIN
+        FOR m IN
+            SELECT generate_series(
+                date_trunc('month', COALESCE((SELECT min(purchase_date) FROM transactions_legacy), now())),
+                date_trunc('month', now()) + interval '{MONTHS_AHEAD} months',
+                interval '1 month'
+            )::date
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+                'transactions_' || to_char(m, 'YYYY_MM'), m, (m + interval '1 month')::date
+            );
+        END LOOP;
+    END $$;
+    """)
+    op.execute('CREATE TABLE transactions_default PARTITION OF transactions DEFAULT')
+
+    # Переносим данные; транзакции без даты покупки получают фиксированную дату (models.PURCHASE_DATE_UNKNOWN)
+    op.execute("""
+    INSERT INTO transactions (id, user_id, product_id, transaction_id, original_transaction_id, type, quantity, purchase_date, raw_data)
+    SELECT id, user_id, product_id, transaction_id, original_transaction_id, type, quantity,
+           COALESCE(purchase_date, '1970-01-01'::timestamp), raw_data::jsonb
+    FROM transactions_legacy
+    """)
+    op.drop_table('transactions_legacy')
+    op.execute('ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.rename_table('transactions', 'transactions_partitioned')
+    op.drop_index('ix_transactions_user_id_purchase_date_id', table_name='transactions_partitioned')
+    op.drop_index('ix_transactions_transaction_id', table_name='transactions_partitioned')
+    op.execute('ALTER TABLE transactions_partitioned RENAME CONSTRAINT transactions_pkey TO transactions_partitioned_pkey')
+    op.execute('ALTER SEQUENCE transactions_id_seq OWNED BY NONE')
+
+    op.create_table('transactions',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('transactions_id_seq'::regclass)"), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('product_id', sa.Integer(), nullable=True),
+    sa.Column('transaction_id', sa.String(), nullable=True),
+    sa.Column('original_transaction_id', sa.String(), nullable=True),
+    sa.Column('type', sa.String(), nullable=True),
+    sa.Column('quantity', sa.Integer(), nullable=True),
+    sa.Column('purchase_date', sa.DateTime(), nullable=True),
+    sa.Column('raw_data', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("""
+    INSERT INTO transactions (id, user_id, product_id, transaction_id, original_transaction_id, type, quantity, purchase_date, raw_data)
+    SELECT id, user_id, product_id, transaction_id, original_transaction_id, type, quantity, purchase_date, raw_data::text
+    FROM transactions_partitioned
+    """)
+    # Отсоединённые ранее (архивные) партиции сюда не попадают — они остаются отдельными таблицами
+    op.drop_table('transactions_partitioned')
+    op.execute('ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id')
+    op.create_index(op.f('ix_transactions_transaction_id'), 'transactions', ['transaction_id'], unique=True)
+    op.create_index(
+        'ix_transactions_user_id_purchase_date_id',
+        'transactions',
+        ['user_id', sa.text('purchase_date DESC'), 'id'],
+        unique=False,
+    )
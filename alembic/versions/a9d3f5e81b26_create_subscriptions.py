@@ -0,0 +1,67 @@
+"""create subscriptions table keyed by original_transaction_id
+
+Revision ID: a9d3f5e81b26
+Revises: 5f2c9b0d7e13
+Create Date: 2025-06-23 14:51:09.642218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9d3f5e81b26'
+down_revision: Union[str, None] = '5f2c9b0d7e13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('subscriptions',
+    sa.Column('original_transaction_id', sa.String(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.Column('auto_renew', sa.Boolean(), nullable=True),
+    sa.Column('last_signed_date', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('original_transaction_id')
+    )
+    op.create_index(op.f('ix_subscriptions_user_id'), 'subscriptions', ['user_id'], unique=False)
+
+    # Заполняем из истории: последняя транзакция по каждому originalTransactionId.
+    # expiresDate лежит в корне raw_data (validate) или в data.signedTransactionInfo (вебхук).
+    op.execute("""
+    INSERT INTO subscriptions (original_transaction_id, user_id, product_id, status, expires_at, updated_at)
+    SELECT latest.original_transaction_id, latest.user_id, latest.product_id,
+           CASE WHEN u.subscription_status = 'active'
+                     AND (latest.expires_at IS NULL OR latest.expires_at > now() AT TIME ZONE 'utc')
+                THEN 'active' ELSE 'inactive' END,
+           latest.expires_at,
+           now() AT TIME ZONE 'utc'
+    FROM (
+        SELECT DISTINCT ON (t.original_transaction_id)
+               t.original_transaction_id, t.user_id, t.product_id,
+               to_timestamp(COALESCE(
+                   (t.raw_data ->> 'expiresDate')::bigint,
+                   (t.raw_data #>> '{data,signedTransactionInfo,expiresDate}')::bigint
+               ) / 1000.0) AT TIME ZONE 'utc' AS expires_at
+        FROM transactions t
+        JOIN products p ON p.id = t.product_id
+        WHERE p.type = 'subscription' AND t.original_transaction_id IS NOT NULL AND t.user_id IS NOT NULL
+        ORDER BY t.original_transaction_id, t.purchase_date DESC, t.id DESC
+    ) latest
+    JOIN users u ON u.id = latest.user_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_subscriptions_user_id'), table_name='subscriptions')
+    op.drop_table('subscriptions')
@@ -0,0 +1,31 @@
+"""make transactions unique by (transaction_id, type, purchase_date)
+
+Revision ID: d2b8e6c4a057
+Revises: a9d3f5e81b26
+Create Date: 2025-06-30 09:44:17.308561
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2b8e6c4a057'
+down_revision: Union[str, None] = 'a9d3f5e81b26'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # REFUND и другие события по уже записанной транзакции журналируются отдельной строкой
+    op.drop_index('ix_transactions_transaction_id', table_name='transactions')
+    op.create_index('ix_transactions_transaction_id_type', 'transactions', ['transaction_id', 'type', 'purchase_date'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_transactions_transaction_id_type', table_name='transactions')
+    op.create_index('ix_transactions_transaction_id', 'transactions', ['transaction_id', 'purchase_date'], unique=True)
@@ -0,0 +1,47 @@
+"""unique transactions by (transaction_id, is reversal, purchase_date)
+
+Revision ID: e7c1a4d9f362
+Revises: d2b8e6c4a057
+Create Date: 2025-07-07 12:06:38.915274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7c1a4d9f362'
+down_revision: Union[str, None] = 'd2b8e6c4a057'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+IS_REVERSAL = "(type IN ('REFUND', 'REVOKE'))"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Убираем повторные строки покупки (например, SUBSCRIBED после PURCHASE из /iap/validate),
+    # оставляя самую раннюю. После миграции агрегаты нужно пересчитать: python -m src.commands.rollups backfill
+    op.execute(f"""
+    DELETE FROM transactions t
+    USING transactions d
+    WHERE t.transaction_id = d.transaction_id
+      AND t.purchase_date = d.purchase_date
+      AND {IS_REVERSAL.replace('type', 't.type')} IS NOT DISTINCT FROM {IS_REVERSAL.replace('type', 'd.type')}
+      AND t.id > d.id
+    """)
+    op.drop_index('ix_transactions_transaction_id_type', table_name='transactions')
+    op.create_index(
+        'ix_transactions_transaction_id_reversal',
+        'transactions',
+        ['transaction_id', sa.text(IS_REVERSAL), 'purchase_date'],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_transactions_transaction_id_reversal', table_name='transactions')
+    op.create_index('ix_transactions_transaction_id_type', 'transactions', ['transaction_id', 'type', 'purchase_date'], unique=True)
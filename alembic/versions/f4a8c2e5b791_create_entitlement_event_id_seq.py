@@ -0,0 +1,28 @@
+"""create entitlement_event_id_seq
+
+Revision ID: f4a8c2e5b791
+Revises: e7c1a4d9f362
+Create Date: 2025-07-08 16:21:53.407719
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4a8c2e5b791'
+down_revision: Union[str, None] = 'e7c1a4d9f362'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(sa.schema.CreateSequence(sa.Sequence('entitlement_event_id_seq')))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(sa.schema.DropSequence(sa.Sequence('entitlement_event_id_seq')))
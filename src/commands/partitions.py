@@ -0,0 +1,29 @@
+# app/commands/partitions.py
+# Обслуживание партиций transactions:
+#   python -m src.commands.partitions ensure [--months-ahead N]
+#   python -m src.commands.partitions detach [--retention-months N] [--drop]
+import argparse
+import asyncio
+
+from src.config import AsyncSessionLocal
+from src.services import partition_service
+
+
+async def main(args: argparse.Namespace):
+    async with AsyncSessionLocal() as db:
+        if args.command == "ensure":
+            names = await partition_service.ensure_future_partitions(db, args.months_ahead)
+        else:
+            names = await partition_service.detach_old_partitions(db, args.retention_months, drop=args.drop)
+    print("\n".join(names) if names else "nothing to do")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage transactions table partitions")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ensure = subparsers.add_parser("ensure", help="create partitions for the upcoming months")
+    ensure.add_argument("--months-ahead", type=int, default=None)
+    detach = subparsers.add_parser("detach", help="detach (archive) partitions older than the retention period")
+    detach.add_argument("--retention-months", type=int, default=None)
+    detach.add_argument("--drop", action="store_true", help="drop detached partitions instead of keeping them")
+    asyncio.run(main(parser.parse_args()))
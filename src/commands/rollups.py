@@ -0,0 +1,22 @@
+# app/commands/rollups.py
+# Перестройка дневных агрегатов daily_product_stats из истории transactions:
+#   python -m src.commands.rollups backfill [--since YYYY-MM-DD] [--workers N]
+import argparse
+import asyncio
+from datetime import date
+
+from src.services import stats_service
+
+
+async def main(args: argparse.Namespace):
+    chunks = await stats_service.backfill(since=args.since, workers=args.workers)
+    print(f"backfilled {chunks} monthly chunks")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain daily_product_stats rollups")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill = subparsers.add_parser("backfill", help="rebuild rollups from the transactions history")
+    backfill.add_argument("--since", type=date.fromisoformat, default=None)
+    backfill.add_argument("--workers", type=int, default=stats_service.BACKFILL_WORKERS)
+    asyncio.run(main(parser.parse_args()))
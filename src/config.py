@@ -13,6 +13,21 @@ class Settings(BaseSettings):
     APPLE_API_ISSUER_ID: str  # Issuer ID (GUID) для App Store Connect API
     APPLE_PRIVATE_KEY_PATH: str
     APPLE_ROOT_CERT_PATH: str  # Путь к Apple Root CA сертификату для проверки вебхуков
+    TRANSACTIONS_PARTITIONS_AHEAD: int = 3  # На сколько месяцев вперёд держать созданные партиции transactions
+    TRANSACTIONS_PARTITIONS_CHECK_HOURS: float = 6  # Как часто работающий процесс досоздаёт партиции
+    TRANSACTIONS_RETENTION_MONTHS: int = 24  # Партиции старше этого срока отсоединяются командой архивации
+    STATS_API_KEY: str | None = None  # Ключ для /stats (заголовок X-Stats-Key); если не задан — эндпоинт закрыт
+    RATE_LIMITS_PER_ACCOUNT_PER_MINUTE: dict[str, int] = {"iap_validate": 30, "auth_apple": 20}  # Лимиты по маршрутам на X-App-Account-Token
+    RATE_LIMITS_PER_IP_PER_MINUTE: dict[str, int] = {"iap_validate": 600, "auth_apple": 300}  # Лимиты на IP — выше: за NAT/прокси много клиентов
+    RATE_LIMIT_TRUSTED_PROXIES: list[str] = []  # IP/подсети своих прокси; за ними IP клиента берётся из X-Forwarded-For
+    RATE_LIMIT_MAX_KEYS: int = 100_000  # Сколько ключей хранить в памяти (старые вытесняются)
+    RATE_LIMIT_REDIS_URL: str | None = None  # Общее состояние лимитов для всех воркеров (нужен extra: pip install apple-subs[redis])
+    APPSTORE_MAX_CONCURRENCY_PER_WORKER: int = 20  # Максимум одновременных запросов к App Store API в одном процессе (общий предел = воркеры × значение)
+    APPSTORE_QUEUE_TIMEOUT: float = 2.0  # Сколько ждать свободного слота, прежде чем отказать с 429
+    EVENTS_HEARTBEAT_SECONDS: float = 15.0  # Интервал keep-alive комментариев в SSE-потоке /iap/events
+    EVENTS_QUEUE_SIZE: int = 32  # Буфер событий на одно SSE-соединение; при переполнении соединение закрывается
+    EVENTS_REPLAY_SIZE: int = 64  # Сколько последних событий на пользователя хранить для Last-Event-ID (не меньше EVENTS_QUEUE_SIZE)
+    EVENTS_REPLAY_USERS: int = 10_000  # Для скольких пользователей хранить историю событий
 
     class Config:
         env_file = ".env"
@@ -1,5 +1,8 @@
 # app/main.py
 
+import asyncio
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI, Request, Response
 from fastapi.exceptions import RequestValidationError
@@ -8,13 +11,27 @@ from fastapi.responses import JSONResponse
 from loguru import logger
 
 from src.config import settings
-from src.routes import apple_webhook, auth, iap
+from src.routes import apple_webhook, auth, iap, stats
+from src.services import events_service, partition_service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Партиции transactions на ближайшие месяцы: при старте и затем периодически
+    partition_maintenance = asyncio.create_task(partition_service.maintain_partitions())
+    # Слушатель Postgres NOTIFY для раздачи событий /iap/events между воркерами
+    events_service.start_listener()
+    yield
+    await events_service.stop_listener()
+    partition_maintenance.cancel()
+
 
 app = FastAPI(
     title="IAP Subscription Service",
     version="1.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 # — CORS (если фронтенд будет на другом домене/API вызывается из браузера) —
@@ -82,6 +99,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(iap.router, prefix="/iap", tags=["iap"])
 app.include_router(apple_webhook.router, tags=["apple"])
+app.include_router(stats.router, prefix="/stats", tags=["stats"])
 
 
 # Простая проверка работоспособности
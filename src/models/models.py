@@ -1,7 +1,8 @@
 # app/models/models.py
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Index, Sequence
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import deferred, relationship
 from datetime import datetime
 
 Base = declarative_base()
@@ -19,6 +20,7 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     transactions = relationship("Transaction", back_populates="user")
+    subscriptions = relationship("Subscription", back_populates="user")
 
 
 class Product(Base):
@@ -34,17 +36,67 @@ class Product(Base):
     transactions = relationship("Transaction", back_populates="product")
 
 
+# purchase_date входит в ключ, поэтому при отсутствии purchaseDate (и originalPurchaseDate) от Apple
+# подставляется фиксированное значение, а не текущее время — повторы той же транзакции дадут тот же ключ
+PURCHASE_DATE_UNKNOWN = datetime(1970, 1, 1)
+
+# События, отменяющие уже записанную покупку: журналируются отдельной строкой с тем же transactionId
+REVERSAL_EVENT_TYPES = ("REFUND", "REVOKE")
+
+
 class Transaction(Base):
+    # Таблица партиционирована по purchase_date (помесячно), см. src/services/partition_service.py
     __tablename__ = "transactions"
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     product_id = Column(Integer, ForeignKey("products.id"))
-    transaction_id = Column(String, unique=True, index=True)          # Идентификатор транзакции Apple (transactionId)
+    transaction_id = Column(String)                                   # Идентификатор транзакции Apple (transactionId)
     original_transaction_id = Column(String, nullable=True)           # Оригинальный идентификатор транзакции Apple для подписок
     type = Column(String)                                             # Например, "PURCHASE", "RENEWAL", "EXPIRED"
     quantity = Column(Integer, default=1)
-    purchase_date = Column(DateTime, nullable=True)
-    raw_data = Column(Text)                                           # Полные сырые данные (JSON или receipt)
+    purchase_date = Column(DateTime, primary_key=True)               # Ключ партиционирования (входит в PK)
+    raw_data = deferred(Column(JSONB))                                # Полные сырые данные (JSON), грузятся только по обращению
 
     user = relationship("User", back_populates="transactions")
     product = relationship("Product", back_populates="transactions")
+
+    __table_args__ = (
+        # Уникальность в партиционированной таблице возможна только вместе с ключом партиционирования
+        # Одна транзакция Apple — одна строка покупки и не более одной строки возврата (REFUND/REVOKE)
+        Index("ix_transactions_transaction_id_reversal", "transaction_id", type.in_(REVERSAL_EVENT_TYPES), "purchase_date", unique=True),
+        # Keyset-пагинация истории: WHERE user_id = ? ORDER BY purchase_date DESC, id
+        Index("ix_transactions_user_id_purchase_date_id", "user_id", purchase_date.desc(), "id"),
+        {"postgresql_partition_by": "RANGE (purchase_date)"},
+    )
+
+
+class Subscription(Base):
+    # Текущее состояние подписки, одна строка на originalTransactionId (у пользователя может быть несколько групп)
+    __tablename__ = "subscriptions"
+    original_transaction_id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    status = Column(String, nullable=False, default="inactive")  # "active" или "inactive"
+    expires_at = Column(DateTime, nullable=True)
+    auto_renew = Column(Boolean, nullable=True)
+    last_signed_date = Column(DateTime, nullable=True)           # signedDate последнего применённого уведомления App Store (не ответа API)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = relationship("User", back_populates="subscriptions")
+    product = relationship("Product")
+
+
+class DailyProductStat(Base):
+    # Инкрементальные дневные агрегаты по продуктам для финансовых отчётов (см. stats_service)
+    __tablename__ = "daily_product_stats"
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    event_type = Column(String, primary_key=True)  # Тип транзакции ("PURCHASE", "DID_RENEW", "REFUND", ...) или "ACTIVE"
+    events = Column(Integer, nullable=False, default=0)    # Для "ACTIVE" — изменение числа активных подписчиков за день
+    quantity = Column(Integer, nullable=False, default=0)
+    credits = Column(Integer, nullable=False, default=0)
+    models = Column(Integer, nullable=False, default=0)
+
+
+# Идентификаторы событий /iap/events (см. events_service.publish_entitlement_change)
+entitlement_event_id_seq = Sequence("entitlement_event_id_seq", metadata=Base.metadata)
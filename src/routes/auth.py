@@ -4,11 +4,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from src.config import settings, get_db
 from src.schemas.auth import AppleSignInRequest, TokenResponse
 from src.external import apple_verifier
-from src.services import user_service
+from src.services import admission_service, user_service
 
 router = APIRouter()
 
-@router.post("/apple", response_model=TokenResponse)
+@router.post("/apple", response_model=TokenResponse, dependencies=[Depends(admission_service.rate_limit("auth_apple"))])
 async def apple_sign_in(payload: AppleSignInRequest, db: AsyncSession = Depends(get_db)):
     # Проверяем identity token от Apple Sign In
     try:
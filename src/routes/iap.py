@@ -1,22 +1,26 @@
 # app/routes/iap.py
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.config import get_db
 from src.models import models
-from src.schemas.iap import IAPValidationRequest, IAPValidationResponse
-from src.services import subscription_service, user_service
+from src.schemas.iap import IAPValidationRequest, IAPValidationResponse, TransactionsPage
+from src.services import admission_service, events_service, subscription_service, transaction_service, user_service
 from src.external import appstore_api
 
 router = APIRouter()
 
-@router.post("/validate", response_model=IAPValidationResponse)
+@router.post("/validate", response_model=IAPValidationResponse, dependencies=[Depends(admission_service.rate_limit("iap_validate"))])
 async def validate_purchase(request: IAPValidationRequest, db: AsyncSession = Depends(get_db), user: models.User = Depends(user_service.get_current_user)):
-    # Проверяем транзакцию через Apple
-    try:
-        transaction_data = await appstore_api.get_transaction_info(transaction_id=request.transaction_id, environment="sandbox")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Transaction validation failed: {str(e)}")
+    # Проверяем транзакцию через Apple (с ограничением числа одновременных запросов)
+    async with admission_service.appstore_slot():
+        try:
+            transaction_data = await appstore_api.get_transaction_info(transaction_id=request.transaction_id, environment="sandbox")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Transaction validation failed: {str(e)}")
     # Находим продукт в нашей базе по productId
     product_id_str = transaction_data.get("productId")
     result = await db.execute(select(models.Product).where(models.Product.product_id == product_id_str))
@@ -34,3 +38,32 @@ async def validate_purchase(request: IAPValidationRequest, db: AsyncSession = De
     elif product.type == "model":
         response.update({"models": updated_user.models})
     return response
+
+
+@router.get("/transactions", response_class=StreamingResponse, responses={200: {"model": TransactionsPage}})
+async def list_transactions(
+    cursor: Optional[str] = None,
+    limit: int = Query(transaction_service.DEFAULT_PAGE_SIZE, ge=1, le=transaction_service.MAX_PAGE_SIZE),
+    include_raw: bool = False,
+    user: models.User = Depends(user_service.get_current_user),
+):
+    # История транзакций пользователя, страницы по курсору (next_cursor из предыдущего ответа)
+    try:
+        stmt = transaction_service.transactions_query(user.id, cursor=cursor, limit=limit, include_raw=include_raw)
+    except transaction_service.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return StreamingResponse(transaction_service.stream_transactions(stmt, limit), media_type="application/json")
+
+
+@router.get("/events", response_class=StreamingResponse)
+async def entitlement_events(
+    request: Request,
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID"),
+    user: models.User = Depends(user_service.get_current_user),
+):
+    # Server-Sent Events: изменения подписки/баланса пользователя (покупки, продления, возвраты)
+    return StreamingResponse(
+        events_service.stream_events(user.id, last_event_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
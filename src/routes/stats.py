@@ -0,0 +1,25 @@
+# app/routes/stats.py
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.config import settings, get_db
+from src.schemas.stats import DailyStatsResponse
+from src.services import stats_service
+
+router = APIRouter()
+
+
+def require_stats_key(x_stats_key: str = Header(..., alias="X-Stats-Key")):
+    if not settings.STATS_API_KEY or x_stats_key != settings.STATS_API_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+@router.get("/daily", response_model=DailyStatsResponse, dependencies=[Depends(require_stats_key)])
+async def daily_stats(date_from: date, date_to: date, product_id: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    # Дневные агрегаты по продуктам и типам событий (читаются из daily_product_stats, без сканов transactions)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+    items = await stats_service.get_daily_stats(db, date_from, date_to, product_id)
+    return {"items": items}
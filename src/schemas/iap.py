@@ -35,3 +35,19 @@ class IAPValidationResponse(BaseModel):
     models: Optional[int] = None
     subscription_status: Optional[str] = None
     subscription_expires_at: Optional[datetime] = None
+
+
+class TransactionItem(BaseModel):
+    id: int
+    transaction_id: Optional[str] = None
+    original_transaction_id: Optional[str] = None
+    product_id: Optional[str] = None
+    type: Optional[str] = None
+    quantity: Optional[int] = None
+    purchase_date: Optional[datetime] = None
+    raw_data: Optional[dict] = None
+
+
+class TransactionsPage(BaseModel):
+    items: list[TransactionItem]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,20 @@
+# app/schemas/stats.py
+from datetime import date
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class DailyStat(BaseModel):
+    day: date
+    product_id: str
+    event_type: str
+    events: int
+    quantity: int
+    credits: int
+    models: int
+    active_subscribers: Optional[int] = None
+
+
+class DailyStatsResponse(BaseModel):
+    items: list[DailyStat]
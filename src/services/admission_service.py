@@ -0,0 +1,160 @@
+# app/services/admission_service.py
+import asyncio
+import ipaddress
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from loguru import logger
+from src.config import settings
+
+SHARDS = 16
+
+
+class TokenBucketStore:
+    # Token bucket в памяти процесса. Ключи разложены по шардам, каждый шард — LRU
+    # ограниченного размера, поэтому память не растёт от числа уникальных клиентов.
+    def __init__(self, max_keys: int, shards: int = SHARDS):
+        self._shards = [OrderedDict() for _ in range(shards)]
+        self._shard_size = max(1, max_keys // shards)
+
+    async def consume(self, key: str, capacity: int, refill_per_sec: float) -> float:
+        """Списывает токен. Возвращает 0, если запрос разрешён, иначе секунды до следующего токена."""
+        shard = self._shards[hash(key) % len(self._shards)]
+        now = time.monotonic()
+        tokens, updated_at = shard.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_sec)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / refill_per_sec
+        shard[key] = (tokens, now)
+        if len(shard) > self._shard_size:
+            shard.popitem(last=False)
+        return retry_after
+
+
+class RedisTokenBucketStore:
+    # Тот же алгоритм в Redis (атомарно через Lua) — лимиты общие для всех воркеров
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local retry_after = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        retry_after = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(retry_after)
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    async def consume(self, key: str, capacity: int, refill_per_sec: float) -> float:
+        try:
+            result = await self._script(keys=[f"ratelimit:{key}"], args=[capacity, refill_per_sec, time.time()])
+            return float(result)
+        except Exception:
+            # Недоступность Redis не должна ронять API — пропускаем запрос
+            logger.exception("Rate limit backend unavailable")
+            return 0.0
+
+
+def _create_store():
+    if settings.RATE_LIMIT_REDIS_URL:
+        try:
+            return RedisTokenBucketStore(settings.RATE_LIMIT_REDIS_URL)
+        except ImportError:
+            logger.error(
+                "RATE_LIMIT_REDIS_URL is set but the redis package is not installed "
+                "(pip install apple-subs[redis]); falling back to per-process rate limits"
+            )
+    return TokenBucketStore(settings.RATE_LIMIT_MAX_KEYS)
+
+
+store = _create_store()
+_appstore_semaphore = asyncio.Semaphore(settings.APPSTORE_MAX_CONCURRENCY_PER_WORKER)
+
+
+def _too_many_requests(retry_after: float, detail: str = "Too many requests") -> HTTPException:
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+_trusted_proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in settings.RATE_LIMIT_TRUSTED_PROXIES]
+
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in _trusted_proxies)
+
+
+# IP клиента: адрес соединения, а если оно пришло от доверенного прокси — первый справа
+# недоверенный адрес из X-Forwarded-For (левые значения клиент может подделать)
+def client_ip(request: Request) -> Optional[str]:
+    host = request.client.host if request.client else None
+    if not host or not _is_trusted_proxy(host):
+        return host
+    forwarded = [part.strip() for part in request.headers.get("X-Forwarded-For", "").split(",") if part.strip()]
+    for candidate in reversed(forwarded):
+        if not _is_trusted_proxy(candidate):
+            return candidate
+    return forwarded[0] if forwarded else host
+
+
+# Зависимость FastAPI: лимиты маршрута route по X-App-Account-Token и, отдельно, по IP клиента.
+# Лимиты задаются в settings.RATE_LIMITS_PER_ACCOUNT_PER_MINUTE и RATE_LIMITS_PER_IP_PER_MINUTE;
+# лимит на IP намеренно выше — за одним адресом (NAT оператора, прокси) бывает много клиентов.
+def rate_limit(route: str):
+    async def dependency(request: Request):
+        checks = []
+        account_limit = settings.RATE_LIMITS_PER_ACCOUNT_PER_MINUTE.get(route)
+        account_token = request.headers.get("X-App-Account-Token")
+        if account_limit and account_token:
+            checks.append((f"{route}:account:{account_token}", account_limit))
+        ip_limit = settings.RATE_LIMITS_PER_IP_PER_MINUTE.get(route)
+        ip = client_ip(request)
+        if ip_limit and ip:
+            checks.append((f"{route}:ip:{ip}", ip_limit))
+        for key, per_minute in checks:
+            retry_after = await store.consume(key, per_minute, per_minute / 60)
+            if retry_after:
+                logger.warning(f"Rate limit exceeded for {key}")
+                raise _too_many_requests(retry_after)
+
+    return dependency
+
+
+# Слот для исходящего запроса в App Store: не больше APPSTORE_MAX_CONCURRENCY_PER_WORKER одновременно
+# в этом процессе. Предел действует на воркер, а не на весь сервис: при N воркерах одновременных
+# запросов может быть до N × значение — настройку выбирают с учётом числа воркеров.
+# Если слот не освободился за APPSTORE_QUEUE_TIMEOUT, запрос отклоняется (load shedding).
+@asynccontextmanager
+async def appstore_slot(timeout: Optional[float] = None):
+    timeout = settings.APPSTORE_QUEUE_TIMEOUT if timeout is None else timeout
+    try:
+        await asyncio.wait_for(_appstore_semaphore.acquire(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("App Store concurrency limit reached, shedding request")
+        raise _too_many_requests(timeout, detail="Service busy, retry later")
+    try:
+        yield
+    finally:
+        _appstore_semaphore.release()
@@ -0,0 +1,168 @@
+# app/services/events_service.py
+import asyncio
+import json
+from collections import OrderedDict, defaultdict, deque
+from typing import AsyncIterator, Optional
+
+import asyncpg
+from loguru import logger
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.config import settings
+from src.models import models
+
+CHANNEL = "entitlement_events"
+RECONNECT_DELAY = 5
+RESYNC_EVENT = "resync"
+
+
+class Subscriber:
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+
+class EventHub:
+    # Pub/sub внутри процесса: события пользователя раздаются его SSE-соединениям.
+    # Короткая история на пользователя позволяет продолжить поток с Last-Event-ID.
+    def __init__(self, queue_size: int, replay_size: int, replay_users: int):
+        self._queue_size = queue_size
+        self._replay_size = replay_size
+        self._replay_users = replay_users
+        self._subscribers: dict[int, set[Subscriber]] = defaultdict(set)
+        self._history: OrderedDict[int, deque] = OrderedDict()
+
+    def subscribe(self, user_id: int, last_event_id: Optional[int] = None) -> Subscriber:
+        subscriber = Subscriber(self._queue_size)
+        if last_event_id is not None:
+            history = self._history.get(user_id)
+            if not history or history[0]["id"] > last_event_id:
+                # Пропущенных событий уже нет в истории (вытеснены или процесс перезапускался) —
+                # просим клиента заново прочитать своё состояние вместо тихого пропуска
+                self._put(subscriber, {"id": history[-1]["id"] if history else last_event_id, "user_id": user_id, "type": RESYNC_EVENT})
+            else:
+                for event in history:
+                    if event["id"] > last_event_id:
+                        self._put(subscriber, event)
+        self._subscribers[user_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id: int, subscriber: Subscriber):
+        subscribers = self._subscribers.get(user_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[user_id]
+
+    def dispatch(self, event: dict):
+        user_id = event["user_id"]
+        history = self._history.pop(user_id, None) or deque(maxlen=self._replay_size)
+        history.append(event)
+        self._history[user_id] = history
+        if len(self._history) > self._replay_users:
+            self._history.popitem(last=False)
+        for subscriber in self._subscribers.get(user_id, ()):
+            self._put(subscriber, event)
+
+    @staticmethod
+    def _put(subscriber: Subscriber, event: dict):
+        try:
+            subscriber.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Медленный клиент: закрываем поток, он переподключится с Last-Event-ID
+            subscriber.overflowed = True
+
+
+hub = EventHub(settings.EVENTS_QUEUE_SIZE, settings.EVENTS_REPLAY_SIZE, settings.EVENTS_REPLAY_USERS)
+_listener_task: Optional[asyncio.Task] = None
+
+
+# Публикация изменения доступа пользователя. pg_notify выполняется в текущей транзакции БД,
+# а Postgres доставляет уведомление только после commit — всем воркерам, включая этот.
+# id события берётся из последовательности под блокировкой строки пользователя: следующая
+# транзакция по тому же пользователю получит id только после нашего commit, поэтому для
+# каждого пользователя id растут в порядке доставки и resume по Last-Event-ID ничего не теряет.
+async def publish_entitlement_change(db: AsyncSession, user: models.User, event_type: str):
+    await db.execute(select(models.User.id).where(models.User.id == user.id).with_for_update())
+    event_id = await db.scalar(select(models.entitlement_event_id_seq.next_value()))
+    payload = {
+        "id": event_id,
+        "user_id": user.id,
+        "type": event_type,
+        "subscription_status": user.subscription_status,
+        "subscription_expires_at": user.subscription_expires_at.isoformat() if user.subscription_expires_at else None,
+        "credits": user.credits,
+        "models": user.models,
+    }
+    await db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": json.dumps(payload)})
+
+
+def _on_notification(connection, pid, channel, payload):
+    try:
+        hub.dispatch(json.loads(payload))
+    except Exception:
+        logger.exception(f"Invalid {CHANNEL} payload: {payload!r}")
+
+
+async def _listen():
+    # Отдельное соединение asyncpg под LISTEN, с переподключением при обрыве
+    dsn = settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(dsn)
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            await connection.add_listener(CHANNEL, _on_notification)
+            logger.info(f"Listening for {CHANNEL}")
+            await closed.wait()
+            logger.warning(f"{CHANNEL} listener connection lost")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"{CHANNEL} listener failed")
+        finally:
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+def start_listener():
+    global _listener_task
+    if _listener_task is None:
+        _listener_task = asyncio.create_task(_listen())
+
+
+async def stop_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+
+
+def _format_event(event: dict) -> str:
+    data = {key: value for key, value in event.items() if key not in ("id", "user_id", "type")}
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(data)}\n\n"
+
+
+# SSE-поток для пользователя: события из hub, heartbeat-комментарии в простое
+async def stream_events(user_id: int, last_event_id: Optional[int], is_disconnected) -> AsyncIterator[str]:
+    subscriber = hub.subscribe(user_id, last_event_id)
+    try:
+        yield f"retry: {RECONNECT_DELAY * 1000}\n\n"
+        while not subscriber.overflowed:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), settings.EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    break
+                yield ": ping\n\n"
+                continue
+            yield _format_event(event)
+    finally:
+        hub.unsubscribe(user_id, subscriber)
@@ -0,0 +1,163 @@
+# app/services/partition_service.py
+import asyncio
+from datetime import date, datetime
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.config import AsyncSessionLocal, settings
+from src.models import models
+
+PARENT_TABLE = "transactions"
+DEFAULT_PARTITION = "transactions_default"
+
+
+def _month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d: date, months: int) -> date:
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def next_month(month: date) -> date:
+    return _add_months(month, 1)
+
+
+# Имя помесячной партиции: transactions_2025_06
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_{month.year:04d}_{month.month:02d}"
+
+
+def _parse_partition_month(name: str) -> Optional[date]:
+    try:
+        year, month = name[len(PARENT_TABLE) + 1:].split("_")
+        return date(int(year), int(month), 1)
+    except ValueError:
+        return None  # например, transactions_default
+
+
+async def list_partitions(db: AsyncSession) -> list[str]:
+    result = await db.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :parent ORDER BY c.relname"
+        ),
+        {"parent": PARENT_TABLE},
+    )
+    return list(result.scalars().all())
+
+
+async def _create_partition(db: AsyncSession, month: date, default_exists: bool):
+    name = partition_name(month)
+    bounds = {"start": month, "end": _add_months(month, 1)}
+    create = text(
+        f'CREATE TABLE "{name}" PARTITION OF {PARENT_TABLE} '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+    )
+    has_rows = default_exists and await db.scalar(
+        text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE purchase_date >= :start AND purchase_date < :end)"),
+        bounds,
+    )
+    if not has_rows:
+        await db.execute(create)
+        return
+    # Строки месяца уже лежат в default — Postgres не даст создать партицию поверх них.
+    # В одной транзакции отсоединяем default, создаём партицию, переносим строки и возвращаем default.
+    await db.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {DEFAULT_PARTITION}"))
+    await db.execute(create)
+    await db.execute(
+        text(f'INSERT INTO "{name}" SELECT * FROM {DEFAULT_PARTITION} WHERE purchase_date >= :start AND purchase_date < :end'),
+        bounds,
+    )
+    await db.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE purchase_date >= :start AND purchase_date < :end"), bounds)
+    await db.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    logger.warning(f"Moved rows from {DEFAULT_PARTITION} into {name}")
+
+
+# Месяцы, для которых в transactions есть присоединённая помесячная партиция
+async def attached_months(db: AsyncSession) -> list[date]:
+    months = (_parse_partition_month(name) for name in await list_partitions(db))
+    return sorted(month for month in months if month is not None)
+
+
+def _retention_cutoff(retention_months: int) -> date:
+    # Месяцы, целиком лежащие раньше этой даты, считаются архивными
+    return _add_months(_month_start(datetime.utcnow().date()), -retention_months)
+
+
+# Создаёт партиции на текущий и months_ahead следующих месяцев, а также на месяцы,
+# строки которых уже попали в default (идемпотентно). Архивные месяцы (старше
+# TRANSACTIONS_RETENTION_MONTHS) не пересоздаются: поздние события за них, например REFUND
+# с датой исходной покупки, остаются в default. Каждая партиция создаётся в своей транзакции,
+# чтобы ошибка на одном месяце не блокировала остальные.
+async def ensure_future_partitions(db: AsyncSession, months_ahead: Optional[int] = None) -> list[str]:
+    months_ahead = settings.TRANSACTIONS_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    existing = set(await list_partitions(db))
+    current = _month_start(datetime.utcnow().date())
+    cutoff = _retention_cutoff(settings.TRANSACTIONS_RETENTION_MONTHS)
+    months = {_add_months(current, offset) for offset in range(months_ahead + 1)}
+    default_exists = DEFAULT_PARTITION in existing
+    if default_exists:
+        result = await db.execute(
+            text(f"SELECT DISTINCT date_trunc('month', purchase_date)::date FROM {DEFAULT_PARTITION} WHERE purchase_date >= :cutoff"),
+            {"cutoff": cutoff},
+        )
+        months.update(month for month in result.scalars().all() if _add_months(month, 1) > cutoff)
+    await db.commit()
+    created = []
+    for month in sorted(months):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        try:
+            if await db.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": f'"{name}"'}):
+                # Таблица с таким именем есть, но не присоединена (например, отсоединённый архив)
+                logger.warning(f"{name} exists outside {PARENT_TABLE}, not recreating it")
+                await db.rollback()
+                continue
+            await _create_partition(db, month, default_exists)
+            await db.commit()
+            created.append(name)
+        except Exception:
+            await db.rollback()
+            logger.exception(f"Failed to create partition {name}")
+    if created:
+        logger.info(f"Created transactions partitions: {created}")
+    return created
+
+
+# Периодическое обслуживание для долго работающего процесса: без него через
+# TRANSACTIONS_PARTITIONS_AHEAD месяцев новые строки начали бы копиться в default
+async def maintain_partitions():
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                await ensure_future_partitions(db)
+        except Exception:
+            logger.exception("Failed to create transactions partitions")
+        await asyncio.sleep(settings.TRANSACTIONS_PARTITIONS_CHECK_HOURS * 3600)
+
+
+# Отсоединяет партиции, целиком лежащие старше retention_months. Отсоединённые таблицы
+# остаются в базе как архив (их можно выгрузить pg_dump), при drop=True — удаляются.
+async def detach_old_partitions(db: AsyncSession, retention_months: Optional[int] = None, drop: bool = False) -> list[str]:
+    retention_months = settings.TRANSACTIONS_RETENTION_MONTHS if retention_months is None else retention_months
+    cutoff = _retention_cutoff(retention_months)
+    detached = []
+    for name in await list_partitions(db):
+        month = _parse_partition_month(name)
+        if month is None or _add_months(month, 1) > cutoff:
+            continue
+        await db.execute(text(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"'))
+        if drop:
+            await db.execute(text(f'DROP TABLE "{name}"'))
+        detached.append(name)
+    await db.commit()
+    if detached:
+        logger.info(f"{'Dropped' if drop else 'Detached'} transactions partitions: {detached}")
+    return detached
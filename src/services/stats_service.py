@@ -0,0 +1,188 @@
+# app/services/stats_service.py
+import asyncio
+from datetime import date, datetime
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import case, delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.config import AsyncSessionLocal
+from src.models import models
+from src.services import partition_service
+
+# Псевдо-тип события: events хранит изменение числа активных подписчиков за день,
+# накопленная сумма по дням даёт число активных подписчиков на дату
+ACTIVE_EVENT = "ACTIVE"
+
+BACKFILL_WORKERS = 4
+
+
+async def _upsert(db: AsyncSession, day: date, product_id: int, event_type: str, events: int, quantity: int = 0, credits: int = 0, models_count: int = 0):
+    stat = models.DailyProductStat.__table__
+    stmt = insert(stat).values(
+        day=day, product_id=product_id, event_type=event_type,
+        events=events, quantity=quantity, credits=credits, models=models_count,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[stat.c.day, stat.c.product_id, stat.c.event_type],
+        set_={
+            "events": stat.c.events + stmt.excluded.events,
+            "quantity": stat.c.quantity + stmt.excluded.quantity,
+            "credits": stat.c.credits + stmt.excluded.credits,
+            "models": stat.c.models + stmt.excluded.models,
+        },
+    )
+    await db.execute(stmt)
+
+
+# Учесть записанную транзакцию в дневном агрегате. Вызывается в той же транзакции БД,
+# что и вставка models.Transaction, поэтому агрегаты не расходятся с журналом.
+async def record_transaction(db: AsyncSession, tx: models.Transaction, product: models.Product):
+    if tx.purchase_date == models.PURCHASE_DATE_UNKNOWN:
+        # Без настоящей даты событие не к чему привязать — в финансовые агрегаты оно не идёт
+        return
+    quantity = tx.quantity or 1
+    await _upsert(
+        db, tx.purchase_date.date(), product.id, tx.type, 1, quantity,
+        (product.credits_count or 0) * quantity, (product.models_count or 0) * quantity,
+    )
+
+
+# Учесть смену статуса подписки пользователя (+1 — стал активным, -1 — перестал)
+async def record_active_delta(db: AsyncSession, product_id: int, delta: int, day: Optional[date] = None):
+    await _upsert(db, day or datetime.utcnow().date(), product_id, ACTIVE_EVENT, delta)
+
+
+async def _lock_stats(db: AsyncSession):
+    # SHARE ROW EXCLUSIVE конфликтует с ROW EXCLUSIVE живых _upsert: они ждут нашего commit, а наш
+    # INSERT ... SELECT видит все транзакции, закоммиченные до получения блокировки, — ни потерь, ни двойного счёта
+    await db.execute(text(f"LOCK TABLE {models.DailyProductStat.__tablename__} IN SHARE ROW EXCLUSIVE MODE"))
+
+
+# Пересчёт агрегатов событий за [start, end) из журнала transactions.
+# lock=True — под блокировкой таблицы агрегатов (для диапазона, куда идут живые записи)
+async def _backfill_chunk(start: date, end: date, lock: bool = False):
+    tx = models.Transaction
+    product = models.Product
+    stat = models.DailyProductStat
+    day = func.date(tx.purchase_date)
+    quantity = func.coalesce(tx.quantity, 1)
+    aggregated = (
+        select(
+            day,
+            tx.product_id,
+            tx.type,
+            func.count(),
+            func.sum(quantity),
+            func.sum(quantity * func.coalesce(product.credits_count, 0)),
+            func.sum(quantity * func.coalesce(product.models_count, 0)),
+        )
+        .join(product, product.id == tx.product_id)
+        .where(tx.purchase_date >= start, tx.purchase_date < end, tx.type.is_not(None))
+        .group_by(day, tx.product_id, tx.type)
+    )
+    async with AsyncSessionLocal() as db:
+        if lock:
+            await _lock_stats(db)
+        await db.execute(delete(stat).where(stat.day >= start, stat.day < end, stat.event_type != ACTIVE_EVENT))
+        await db.execute(
+            insert(stat).from_select(
+                [stat.day, stat.product_id, stat.event_type, stat.events, stat.quantity, stat.credits, stat.models],
+                aggregated,
+            )
+        )
+        await db.commit()
+    logger.info(f"Backfilled daily_product_stats for {start}..{end}")
+
+
+# Сверка ACTIVE с текущим состоянием subscriptions. История дельт не перезаписывается (восстановить
+# её из журнала нельзя: события без смены статуса в transactions не пишутся) — если сумма дельт
+# по продукту расходится с числом активных подписок, разница записывается одной поправкой за сегодня.
+async def _backfill_active():
+    subscription = models.Subscription
+    stat = models.DailyProductStat
+    async with AsyncSessionLocal() as db:
+        await _lock_stats(db)
+        actual = dict((await db.execute(
+            select(subscription.product_id, func.count())
+            .where(subscription.status == "active")
+            .group_by(subscription.product_id)
+        )).all())
+        recorded = dict((await db.execute(
+            select(stat.product_id, func.sum(stat.events))
+            .where(stat.event_type == ACTIVE_EVENT)
+            .group_by(stat.product_id)
+        )).all())
+        for product_id in actual.keys() | recorded.keys():
+            correction = actual.get(product_id, 0) - (recorded.get(product_id) or 0)
+            if correction:
+                await record_active_delta(db, product_id, correction)
+                logger.warning(f"ACTIVE rollup for product {product_id} corrected by {correction}")
+        await db.commit()
+
+
+# Полная перестройка агрегатов из истории: по месяцу на кусок, только для месяцев с присоединённой
+# партицией transactions. Архивные (отсоединённые) месяцы и строки с PURCHASE_DATE_UNKNOWN в
+# default не трогаются — их агрегаты пересчитать не из чего, поэтому они не удаляются.
+# Закрытые месяцы пересчитываются параллельно в отдельных сессиях без блокировок; текущий
+# и будущие месяцы, куда пишут живые _upsert, — последними и под LOCK TABLE (живые записи ждут commit).
+# Поздние события за закрытые месяцы (например, REFUND с датой исходной покупки), пришедшие
+# во время пересчёта своего месяца, могут быть потеряны — такой месяц достаточно пересчитать ещё раз.
+async def backfill(since: Optional[date] = None, workers: int = BACKFILL_WORKERS) -> int:
+    async with AsyncSessionLocal() as db:
+        months = await partition_service.attached_months(db)
+    if since:
+        months = [month for month in months if month >= date(since.year, since.month, 1)]
+    chunks = [(month, partition_service.next_month(month)) for month in months]
+    today = datetime.utcnow().date()
+    open_month = date(today.year, today.month, 1)
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run(chunk):
+        async with semaphore:
+            await _backfill_chunk(*chunk)
+
+    await asyncio.gather(*(run(chunk) for chunk in chunks if chunk[0] < open_month))
+    for chunk in chunks:
+        if chunk[0] >= open_month:
+            await _backfill_chunk(*chunk, lock=True)
+    await _backfill_active()
+    return len(chunks)
+
+
+# Чтение агрегатов за период — читаются только строки [date_from, date_to]. Для "ACTIVE"
+# active_subscribers = сумма дельт до date_from (одна агрегация) + накопленная сумма внутри периода
+async def get_daily_stats(db: AsyncSession, date_from: date, date_to: date, product_id: Optional[str] = None) -> list[dict]:
+    stat = models.DailyProductStat
+    seed = (
+        select(stat.product_id, func.sum(stat.events).label("events"))
+        .where(stat.event_type == ACTIVE_EVENT, stat.day < date_from)
+        .group_by(stat.product_id)
+        .subquery()
+    )
+    running = func.sum(stat.events).over(partition_by=(stat.product_id, stat.event_type), order_by=stat.day)
+    active_subscribers = case(
+        (stat.event_type == ACTIVE_EVENT, func.coalesce(seed.c.events, 0) + running),
+        else_=None,
+    )
+    stmt = (
+        select(
+            stat.day,
+            models.Product.product_id,
+            stat.event_type,
+            stat.events,
+            stat.quantity,
+            stat.credits,
+            stat.models,
+            active_subscribers.label("active_subscribers"),
+        )
+        .join(models.Product, models.Product.id == stat.product_id)
+        .outerjoin(seed, seed.c.product_id == stat.product_id)
+        .where(stat.day >= date_from, stat.day <= date_to)
+        .order_by(stat.day, models.Product.product_id, stat.event_type)
+    )
+    if product_id:
+        stmt = stmt.where(models.Product.product_id == product_id)
+    result = await db.execute(stmt)
+    return [dict(row) for row in result.mappings()]
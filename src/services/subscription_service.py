@@ -1,18 +1,93 @@
 # app/services/subscription_service.py
-import json
 from datetime import datetime
-from sqlalchemy import select
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.models import models
+from src.services import events_service, stats_service
+
+ACTIVATING_EVENTS = ["SUBSCRIBED", "RENEWED", "DID_RENEW", "RESUBSCRIBE"]
+DEACTIVATING_EVENTS = ["EXPIRED", "CANCEL", "DID_FAIL_TO_RENEW"]
+
+
+def _from_ms(value) -> Optional[datetime]:
+    return datetime.utcfromtimestamp(value / 1000) if value else None
+
+
+def _purchase_date(transaction_info: dict) -> datetime:
+    purchase_ms = transaction_info.get("purchaseDate") or transaction_info.get("originalPurchaseDate")
+    return _from_ms(purchase_ms) or models.PURCHASE_DATE_UNKNOWN
+
+
+# Строка subscriptions под блокировкой (FOR UPDATE) — события по одной подписке применяются по очереди.
+# Если строки ещё нет, она создаётся; ON CONFLICT защищает от гонки validate и вебхука.
+async def _lock_subscription(db: AsyncSession, original_transaction_id: str, user: models.User, product: models.Product) -> models.Subscription:
+    subscription = await db.get(models.Subscription, original_transaction_id, with_for_update=True, populate_existing=True)
+    if subscription is None:
+        await db.execute(
+            insert(models.Subscription)
+            .values(original_transaction_id=original_transaction_id, user_id=user.id, product_id=product.id, status="inactive", updated_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=["original_transaction_id"])
+        )
+        subscription = await db.get(models.Subscription, original_transaction_id, with_for_update=True, populate_existing=True)
+    return subscription
+
+
+def _is_stale(subscription: models.Subscription, signed_date: Optional[datetime]) -> bool:
+    # Apple не гарантирует порядок доставки: уведомление, подписанное раньше уже применённого, устарело.
+    # Сравниваются только signedDate уведомлений — signedDate ответа API при validate это «сейчас».
+    return bool(signed_date and subscription.last_signed_date and signed_date < subscription.last_signed_date)
+
+
+# Сводный статус пользователя: активен, если активна хотя бы одна его подписка;
+# срок действия — самый поздний expires_at среди активных подписок
+async def _refresh_user_status(db: AsyncSession, user: models.User):
+    active_count, expires_at = (await db.execute(
+        select(func.count(), func.max(models.Subscription.expires_at))
+        .where(models.Subscription.user_id == user.id, models.Subscription.status == "active")
+    )).one()
+    user.subscription_status = "active" if active_count else "inactive"
+    user.subscription_expires_at = expires_at
+
+
+# Применить событие к подписке: владелец, продукт, срок действия и (если заданы) статус. Статистика активных
+# подписчиков считается от переходов по конкретной подписке: смена статуса даёт ±1 текущему продукту,
+# смена продукта у активной подписки (upgrade/crossgrade) переносит +1 со старого продукта на новый.
+async def _update_subscription(db: AsyncSession, user: models.User, product: models.Product, subscription: models.Subscription, status: Optional[str] = None, expires_at: Optional[datetime] = None):
+    previous_owner_id = subscription.user_id
+    if expires_at:
+        subscription.expires_at = expires_at
+    if subscription.status == "active" and subscription.product_id != product.id:
+        await stats_service.record_active_delta(db, subscription.product_id, -1)
+        await stats_service.record_active_delta(db, product.id, +1)
+    subscription.user_id = user.id
+    subscription.product_id = product.id
+    if status and subscription.status != status:
+        await stats_service.record_active_delta(db, product.id, +1 if status == "active" else -1)
+        subscription.status = status
+    await _refresh_user_status(db, user)
+    if previous_owner_id != user.id:
+        # Подписка перешла к другому аккаунту (restore) — пересчитываем статус прежнего владельца
+        previous_owner = await db.get(models.User, previous_owner_id)
+        if previous_owner:
+            await _refresh_user_status(db, previous_owner)
+            await events_service.publish_entitlement_change(db, previous_owner, "OWNERSHIP_CHANGED")
+
 
 # Применить проверенную покупку к аккаунту пользователя (начисление credits, models или активация подписки)
 async def apply_purchase(db: AsyncSession, user: models.User, product: models.Product, transaction_data: dict, event_type: str = "PURCHASE") -> models.User:
     # Обновляем данные пользователя в зависимости от типа продукта
     if product.type == "subscription":
-        user.subscription_status = "active"
-        expires_ms = transaction_data.get("expiresDate")
-        if expires_ms:
-            user.subscription_expires_at = datetime.utcfromtimestamp(expires_ms / 1000)
+        original_tx = transaction_data.get("originalTransactionId") or transaction_data.get("transactionId")
+        subscription = await _lock_subscription(db, original_tx, user, product)
+        # Порядок validate относительно уведомлений не известен — срок действия только продлеваем
+        expires_at = _from_ms(transaction_data.get("expiresDate"))
+        if subscription.expires_at and expires_at and expires_at <= subscription.expires_at:
+            expires_at = None
+        await _update_subscription(db, user, product, subscription, "active", expires_at)
     elif product.type == "credits":
         user.credits += product.credits_count or 0
     elif product.type == "model":
@@ -25,10 +100,12 @@ async def apply_purchase(db: AsyncSession, user: models.User, product: models.Pr
         original_transaction_id=transaction_data.get("originalTransactionId"),
         type=event_type,
         quantity=transaction_data.get("quantity", 1),
-        purchase_date=datetime.utcfromtimestamp(transaction_data.get("purchaseDate", 0) / 1000) if transaction_data.get("purchaseDate") else None,
-        raw_data=json.dumps(transaction_data)
+        purchase_date=_purchase_date(transaction_data),
+        raw_data=transaction_data
     )
     db.add(tx)
+    await stats_service.record_transaction(db, tx, product)
+    await events_service.publish_entitlement_change(db, user, event_type)
     await db.commit()
     # Обновляем объект пользователя и возвращаем его
     await db.refresh(user)
@@ -46,14 +123,12 @@ async def process_app_store_notification(db: AsyncSession, notification: dict):
     if app_account_token:
         result = await db.execute(select(models.User).where(models.User.app_account_token == app_account_token))
         user = result.scalars().first()
-    if not user:
-        # Альтернатива: поиск по original_transaction_id (для подписок)
-        original_tx = transaction_info.get("originalTransactionId")
-        if original_tx:
-            result = await db.execute(select(models.Transaction).where(models.Transaction.original_transaction_id == original_tx))
-            existing_tx = result.scalars().first()
-            if existing_tx:
-                user = await db.get(models.User, existing_tx.user_id)
+    original_tx = transaction_info.get("originalTransactionId")
+    if not user and original_tx:
+        # Альтернатива: владелец подписки по original_transaction_id (поиск по первичному ключу)
+        subscription = await db.get(models.Subscription, original_tx)
+        if subscription:
+            user = await db.get(models.User, subscription.user_id)
     if not user:
         return None  # Пользователь не найден для этого уведомления
     # Находим продукт, связанный с транзакцией
@@ -64,14 +139,22 @@ async def process_app_store_notification(db: AsyncSession, notification: dict):
         return None
     # Определяем тип уведомления и обновляем пользователя
     event_type = notification.get("notificationType") or "UNKNOWN"
-    if product.type == "subscription":
-        if event_type in ["SUBSCRIBED", "RENEWED", "DID_RENEW", "RESUBSCRIBE"]:
-            user.subscription_status = "active"
-            expires_ms = transaction_info.get("expiresDate")
-            if expires_ms:
-                user.subscription_expires_at = datetime.utcfromtimestamp(expires_ms / 1000)
-        elif event_type in ["EXPIRED", "CANCEL", "DID_FAIL_TO_RENEW"]:
-            user.subscription_status = "inactive"
+    stale = False
+    if product.type == "subscription" and original_tx:
+        subscription = await _lock_subscription(db, original_tx, user, product)
+        signed_date = _from_ms(notification.get("signedDate"))
+        stale = _is_stale(subscription, signed_date)
+        if stale:
+            # Состояние не трогаем, но событие всё равно попадает в журнал и агрегаты ниже
+            logger.info(f"Stale {event_type} notification for {original_tx}, subscription state not changed")
+        else:
+            subscription.last_signed_date = signed_date or subscription.last_signed_date
+            renewal_info = data.get("signedRenewalInfo") or {}
+            if "autoRenewStatus" in renewal_info:
+                subscription.auto_renew = renewal_info["autoRenewStatus"] == 1
+            status = "active" if event_type in ACTIVATING_EVENTS else "inactive" if event_type in DEACTIVATING_EVENTS else None
+            expires_at = _from_ms(transaction_info.get("expiresDate")) if status == "active" else None
+            await _update_subscription(db, user, product, subscription, status, expires_at)
     elif product.type == "credits":
         if event_type == "REFUND":
             quantity = transaction_info.get("quantity", 1)
@@ -82,10 +165,20 @@ async def process_app_store_notification(db: AsyncSession, notification: dict):
             quantity = transaction_info.get("quantity", 1)
             refund_amount = (product.models_count or 0) * quantity
             user.models = user.models - refund_amount if user.models >= refund_amount else 0
-    # Логируем это событие в таблицу Transaction, если еще не записано
+    # Логируем это событие в таблицу Transaction, если еще не записано. Покупка дедуплицируется по transactionId:
+    # SUBSCRIBED/ONE_TIME_CHARGE после /iap/validate и события без новой транзакции (DID_CHANGE_RENEWAL_STATUS и т.п.)
+    # повторно не пишутся. REFUND/REVOKE приходят с transactionId покупки и получают свою строку.
     tx_id = transaction_info.get("transactionId")
+    purchase_date = _purchase_date(transaction_info)
     if tx_id:
-        result = await db.execute(select(models.Transaction).where(models.Transaction.transaction_id == tx_id))
+        is_reversal = models.Transaction.type.in_(models.REVERSAL_EVENT_TYPES)
+        result = await db.execute(
+            select(models.Transaction.id).where(
+                models.Transaction.transaction_id == tx_id,
+                models.Transaction.purchase_date == purchase_date,
+                is_reversal if event_type in models.REVERSAL_EVENT_TYPES else ~is_reversal,
+            )
+        )
         existing = result.scalars().first()
     else:
         existing = None
@@ -97,9 +190,12 @@ async def process_app_store_notification(db: AsyncSession, notification: dict):
             original_transaction_id=transaction_info.get("originalTransactionId"),
             type=event_type,
             quantity=transaction_info.get("quantity", 1),
-            purchase_date=datetime.utcfromtimestamp(transaction_info.get("purchaseDate", 0) / 1000) if transaction_info.get("purchaseDate") else None,
-            raw_data=json.dumps(notification)
+            purchase_date=purchase_date,
+            raw_data=notification
         )
         db.add(tx)
+        await stats_service.record_transaction(db, tx, product)
+    if not stale:
+        await events_service.publish_entitlement_change(db, user, event_type)
     await db.commit()
     return user
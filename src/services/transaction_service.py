@@ -0,0 +1,97 @@
+# app/services/transaction_service.py
+import base64
+import json
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import and_, or_, select
+from src.config import AsyncSessionLocal
+from src.models import models
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Курсор — непрозрачная строка с позицией последней отданной строки (purchase_date, id)
+def encode_cursor(purchase_date: datetime, tx_id: int) -> str:
+    raw = f"{purchase_date.isoformat()}|{tx_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        date_str, id_str = base64.urlsafe_b64decode(padded).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(date_str), int(id_str)
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+
+# Запрос страницы истории транзакций пользователя (keyset-пагинация по (purchase_date DESC, id)).
+# Порядок совпадает с индексом ix_transactions_user_id_purchase_date_id, поэтому стоимость
+# запроса не зависит от глубины страницы. Транзакции без даты от Apple хранятся с
+# models.PURCHASE_DATE_UNKNOWN и идут в конце истории. raw_data загружается только по запросу.
+def transactions_query(user_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, include_raw: bool = False):
+    tx = models.Transaction
+    columns = [
+        tx.id,
+        tx.transaction_id,
+        tx.original_transaction_id,
+        models.Product.product_id,
+        tx.type,
+        tx.quantity,
+        tx.purchase_date,
+    ]
+    if include_raw:
+        columns.append(tx.raw_data)
+    stmt = (
+        select(*columns)
+        .outerjoin(models.Product, models.Product.id == tx.product_id)
+        .where(tx.user_id == user_id)
+        .order_by(tx.purchase_date.desc(), tx.id)
+        .limit(limit + 1)
+    )
+    if cursor:
+        last_date, last_id = decode_cursor(cursor)
+        stmt = stmt.where(
+            # Избыточное условие даёт Postgres стартовый ключ в индексе, OR ниже только уточняет
+            tx.purchase_date <= last_date,
+            or_(
+                tx.purchase_date < last_date,
+                and_(tx.purchase_date == last_date, tx.id > last_id),
+            ),
+        )
+    return stmt
+
+
+# Потоковая выдача страницы: строки читаются из БД серверным курсором (db.stream) и сразу
+# сериализуются, так что в памяти одновременно находится одна строка, а не вся страница.
+# Своя сессия: сессия зависимости get_db закрывается до начала отправки тела ответа.
+async def stream_transactions(stmt, limit: int) -> AsyncIterator[bytes]:
+    yield b'{"items":['
+    next_cursor = None
+    last = None
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt)
+        count = 0
+        async for row in result.mappings():
+            if count == limit:
+                # limit + 1-я строка только сообщает, что есть следующая страница
+                next_cursor = encode_cursor(last["purchase_date"], last["id"])
+                break
+            prefix = b"," if count else b""
+            yield prefix + json.dumps(dict(row), default=_json_default, ensure_ascii=False).encode("utf-8")
+            last = row
+            count += 1
+        await result.close()
+    yield b'],"next_cursor":' + json.dumps(next_cursor).encode("utf-8") + b"}"
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")